@@ -1,20 +1,263 @@
 #!/usr/bin/env python3
 import argparse
 import csv
+import ctypes
+import functools
+import mmap
+import os
 import subprocess
 import sys
 import re
 import json
+import tempfile
 import time
 import threading
-import statistics
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import List, Dict, Optional
 import requests
 
-@dataclass
+try:
+    import orjson  # 2-5x faster than stdlib json for large iperf3 reports
+except ImportError:
+    orjson = None
+
+# tmpfs scratch space for iperf3 logfiles; falls back to the regular tmp
+# dir on hosts without /dev/shm.
+_SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+# libiperf (shipped with iperf >= 3.6) lets TCP tests run in-process,
+# skipping the ~10-20 ms fork+exec+ELF-load per test. Optional; every call
+# site falls back to the iperf3 binary when the library is absent.
+try:
+    _LIBIPERF = ctypes.CDLL("libiperf.so.0")
+    _LIBIPERF.iperf_new_test.restype = ctypes.c_void_p
+    _LIBIPERF.iperf_get_test_json_output_string.restype = ctypes.c_char_p
+except OSError:
+    _LIBIPERF = None
+
+# Default iperf3 port; concurrent TX/RX tests use IPERF3_BASE_PORT and
+# IPERF3_BASE_PORT + 1 since an iperf3 server accepts only one client at a time.
+IPERF3_BASE_PORT = 5201
+
+# How long a latency/system-metrics sample stays fresh. The ping probe alone
+# takes ~10 s, so re-running it for every BenchmarkResult dominates wall clock.
+PROBE_CACHE_TTL_S = 5.0
+
+# Compiled once at import and run directly on the raw ping output, skipping
+# the per-line split/scan. Byte patterns so stdout never needs decoding.
+_PING_SUM_RE = re.compile(
+    rb'rtt min/avg/max/mdev = (\d+\.?\d*)/(\d+\.?\d*)/(\d+\.?\d*)/(\d+\.?\d*)')
+_PING_TIME_RE = re.compile(rb'time=(\d+\.?\d*) ms')
+
+# Final sender summary line of iperf3 text output, e.g.
+# "[  5]  0.00-10.00 sec  1.10 GBytes   941 Mbits/sec    0   sender"
+_IPERF3_SENDER_RE = re.compile(rb'(\d+\.?\d*)\s+([KMG]?)bits/sec.*sender')
+_BPS_UNIT = {b'': 1, b'K': 1e3, b'M': 1e6, b'G': 1e9}
+
+def _load_json_file(path: str) -> Dict:
+    """Parse a JSON report file through an mmap'd buffer.
+
+    Avoids a second in-memory copy of multi-hundred-KB iperf3 reports and
+    uses orjson when available.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if orjson is not None:
+                data = orjson.loads(memoryview(buf))
+            else:
+                data = json.loads(buf[:])
+        # Parsed and done with the pages; tell the kernel to drop them so
+        # back-to-back tests don't accumulate page cache.
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+        return data
+
+@functools.cache
+def _static_topology() -> tuple:
+    """(cpu_count, numa_nodes); neither changes while the benchmark runs."""
+    cpu_count = 0
+    numa_nodes = 0
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            cpu_count = len([line for line in f if line.startswith('processor')])
+        # One directory listing beats deriving the node count from the
+        # per-(node, zone) lines of /proc/buddyinfo.
+        numa_nodes = sum(1 for d in os.listdir('/sys/devices/system/node')
+                         if d.startswith('node') and d[4:].isdigit())
+    except OSError as e:
+        print(f"Failed to read CPU topology: {e}")
+    return cpu_count, numa_nodes
+
+# Persistent fd for /proc/stat: procfs supports pread from offset 0, so one
+# open serves every sample instead of an open/read/close cycle per call.
+# Left open for the process lifetime, like the benchmark's other handles.
+_STAT_FD = None
+
+def _sample_cpu() -> tuple:
+    """One (total, idle) jiffies sample from the first line of /proc/stat."""
+    global _STAT_FD
+    if _STAT_FD is None:
+        _STAT_FD = os.open('/proc/stat', os.O_RDONLY)
+    # The aggregate cpu line is at most ~120 bytes even on long uptimes
+    fields = os.pread(_STAT_FD, 256, 0).split(b'\n', 1)[0].split()
+    total = sum(int(x) for x in fields[1:])
+    return total, int(fields[4])
+
+def _run_libiperf(host: str, port: int, duration: int, streams: int = 8,
+                  reverse: bool = False) -> Optional[Dict]:
+    """Run a TCP client test through libiperf and return the parsed report.
+
+    Returns None on any failure so callers can fall back to the iperf3
+    binary. Each call drives its own iperf_test context, so concurrent
+    tests from different threads are safe.
+    """
+    test = ctypes.c_void_p(_LIBIPERF.iperf_new_test())
+    if not test:
+        return None
+    try:
+        _LIBIPERF.iperf_defaults(test)
+        _LIBIPERF.iperf_set_test_role(test, ctypes.c_char(b'c'))
+        _LIBIPERF.iperf_set_test_server_hostname(test, host.encode())
+        _LIBIPERF.iperf_set_test_server_port(test, port)
+        _LIBIPERF.iperf_set_test_duration(test, duration)
+        _LIBIPERF.iperf_set_test_num_streams(test, streams)
+        _LIBIPERF.iperf_set_test_reverse(test, int(reverse))
+        _LIBIPERF.iperf_set_test_reporter_interval(test, ctypes.c_double(0))
+        _LIBIPERF.iperf_set_test_stats_interval(test, ctypes.c_double(0))
+        _LIBIPERF.iperf_set_test_omit(test, 2)
+        _LIBIPERF.iperf_set_test_blksize(test, 256 * 1024)
+        if _kernel_supports_zerocopy():
+            _LIBIPERF.iperf_set_test_zerocopy(test, 1)
+        _LIBIPERF.iperf_set_test_json_output(test, 1)
+
+        if _LIBIPERF.iperf_run_client(test) < 0:
+            return None
+        raw = _LIBIPERF.iperf_get_test_json_output_string(test)
+        return json.loads(raw) if raw else None
+    except (ValueError, AttributeError) as e:
+        print(f"libiperf test failed: {e}")
+        return None
+    finally:
+        _LIBIPERF.iperf_free_test(test)
+
+def _mean(values, default: float = 0.0) -> float:
+    """Plain sum/len mean; statistics.mean pays for exact Fraction
+    arithmetic and raises on empty input (its call sites here passed a
+    default= kwarg it does not accept)."""
+    values = list(values)
+    return sum(values) / len(values) if values else default
+
+def _kernel_supports_zerocopy() -> bool:
+    """iperf3 -Z needs sendfile-based zero-copy, present since kernel 3.9."""
+    try:
+        major, minor = os.uname().release.split('.')[:2]
+        return (int(major), int(minor)) >= (3, 9)
+    except ValueError:
+        return False
+
+def _sum_bps(result: Dict) -> float:
+    """Total sender bits/sec across all streams of an iperf3 JSON report.
+
+    Reading only streams[0], as the old inline .get() chains did, silently
+    dropped 7/8 of the throughput at -P 8.
+    """
+    return sum(s.get('sender', {}).get('bits_per_second', 0)
+               for s in result.get('end', {}).get('streams', []))
+
+def _parse_cpulist(cpulist: str) -> List[int]:
+    """Parse a sysfs cpulist string like '0-3,8-11' into a list of CPU ids."""
+    cpus = []
+    for chunk in cpulist.strip().split(','):
+        if not chunk:
+            continue
+        if '-' in chunk:
+            start, end = chunk.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(chunk))
+    return cpus
+
+def _numa_interleaved_cpus() -> List[int]:
+    """Return CPU ids round-robined across NUMA nodes.
+
+    Spreading workers over nodes avoids saturating a single node's memory
+    bandwidth; falls back to a flat 0..n-1 list on non-NUMA hosts.
+    """
+    node_cpus = []
+    try:
+        node_dir = '/sys/devices/system/node/'
+        for entry in sorted(os.listdir(node_dir)):
+            if re.fullmatch(r'node\d+', entry):
+                with open(os.path.join(node_dir, entry, 'cpulist')) as f:
+                    node_cpus.append(_parse_cpulist(f.read()))
+    except OSError:
+        pass
+
+    if not node_cpus:
+        return list(range(os.cpu_count() or 1))
+
+    interleaved = []
+    for i in range(max(len(cpus) for cpus in node_cpus)):
+        for cpus in node_cpus:
+            if i < len(cpus):
+                interleaved.append(cpus[i])
+    return interleaved
+
+def _run_stream(target_host: str, duration: int, cpu: int) -> float:
+    """Run one pinned iperf3 stream and return its sender bits/sec.
+
+    Module-level so ProcessPoolExecutor can pickle it; returns instead of
+    mutating shared state, so no lock is needed. Only the final sender
+    number is wanted here, so the stream runs in text mode and a single
+    regex pass pulls it from the summary line — an order of magnitude
+    cheaper than parsing the full JSON report.
+    """
+    try:
+        os.sched_setaffinity(0, {cpu})
+    except OSError:
+        pass
+
+    cmd = [
+        "taskset", "-c", str(cpu),
+        "iperf3", "-c", target_host,
+        "-t", str(duration),
+        "-P", "1",
+        "-i", "0", "--omit", "2",
+        "-l", "256K"
+    ]
+    if _kernel_supports_zerocopy():
+        cmd.append("-Z")
+
+    try:
+        # close_fds=False everywhere in this script: nothing here leaks
+        # inheritable fds, and skipping the close scan lets subprocess take
+        # its posix_spawn fast path instead of fork+exec, which adds up on
+        # the 32-worker concurrent path.
+        result = subprocess.run(cmd, capture_output=True,
+                                timeout=duration + 10, close_fds=False)
+        if result.returncode == 0:
+            matches = _IPERF3_SENDER_RE.findall(result.stdout)
+            if matches:
+                value, unit = matches[-1]
+                return float(value) * _BPS_UNIT[unit]
+    except Exception as e:
+        print(f"Stream on CPU {cpu} failed: {e}")
+    return 0
+
+@dataclass(slots=True, frozen=True)
 class BenchmarkResult:
-    """Benchmark result data structure."""
+    """Benchmark result data structure.
+
+    Slotted and immutable: results are write-once records, and __slots__
+    halves per-instance memory and speeds the attribute walks in the
+    summary reductions.
+    """
     test_name: str
     throughput_gbps: float
     latency_us: float
@@ -31,37 +274,149 @@ class VirtIONicBenchmark:
         self.target_host = target_host
         self.duration = duration
         self.results: List[BenchmarkResult] = []
-        
-    def run_iperf3_test(self, reverse: bool = False, protocol: str = "tcp") -> Dict:
+        self._latency_cache: Optional[Dict] = None
+        self._latency_cache_time = 0.0
+        self._metrics_cache: Optional[Dict] = None
+        self._metrics_cache_time = 0.0
+        self._nic_cpus: Optional[List[int]] = None
+        self._nic_cpus_resolved = False
+        self._cpu_sample: Optional[tuple] = None
+        # Running aggregates updated by _record so summary queries stay
+        # O(1) even across long soak runs with many results.
+        self._agg = {
+            "tp_max": 0.0,
+            "lat_min": float('inf'),
+            "cpu_sum": 0.0,
+            "n": 0,
+            "passed": 0,
+            "queue_max": 0,
+        }
+
+    def _record(self, result: BenchmarkResult):
+        """Append a result and fold it into the running aggregates."""
+        self.results.append(result)
+        agg = self._agg
+        agg["tp_max"] = max(agg["tp_max"], result.throughput_gbps)
+        if result.latency_us > 0:
+            agg["lat_min"] = min(agg["lat_min"], result.latency_us)
+        agg["cpu_sum"] += result.cpu_usage
+        agg["n"] += 1
+        if result.throughput_gbps > 0:
+            agg["passed"] += 1
+        agg["queue_max"] = max(agg["queue_max"], result.queue_count)
+
+    def _nic_numa_cpus(self) -> Optional[List[int]]:
+        """CPUs local to the NUMA node of the NIC that routes to the target.
+
+        Resolves the outbound interface with `ip route get`, then follows
+        /sys/class/net/<if>/device/numa_node to that node's cpulist. Returns
+        None on non-NUMA hosts or when the route cannot be resolved; the
+        result is cached since the route does not change mid-benchmark.
+        """
+        if self._nic_cpus_resolved:
+            return self._nic_cpus
+        self._nic_cpus_resolved = True
+
+        try:
+            route = subprocess.run(
+                ["ip", "route", "get", self.target_host],
+                capture_output=True, text=True, timeout=5, close_fds=False)
+            match = re.search(r'\bdev\s+(\S+)', route.stdout)
+            if not match:
+                return None
+            iface = match.group(1)
+
+            with open(f'/sys/class/net/{iface}/device/numa_node') as f:
+                node = int(f.read().strip())
+            if node < 0:
+                return None
+
+            with open(f'/sys/devices/system/node/node{node}/cpulist') as f:
+                self._nic_cpus = _parse_cpulist(f.read())
+        except (OSError, ValueError, subprocess.SubprocessError):
+            self._nic_cpus = None
+
+        return self._nic_cpus
+
+    def run_iperf3_test(self, reverse: bool = False, protocol: str = "tcp",
+                        port: int = IPERF3_BASE_PORT) -> Dict:
         """Run iperf3 test and parse results."""
+        # In-process fast path: no fork+exec and no logfile round-trip.
+        # UDP stays on the binary, as does any libiperf failure.
+        if _LIBIPERF is not None and protocol == "tcp":
+            data = _run_libiperf(self.target_host, port, self.duration,
+                                 streams=8, reverse=reverse)
+            if data is not None:
+                return data
+
         cmd = [
-            "iperf3", "-c", self.target_host, 
+            "iperf3", "-c", self.target_host,
+            "-p", str(port),
             "-t", str(self.duration),
             "-J",  # JSON output
-            "-P", "8"  # 8 parallel streams
+            "-P", "8",  # 8 parallel streams
+            "-i", "0",  # only the final sum matters; skip interval stats
+            "--omit", "2"  # drop the TCP slow-start window from the numbers
         ]
-        
+
+        # Pin the client to the NIC's NUMA node; cross-node DMA and cache
+        # line ping-pong cap bandwidth well below the 20 Gbps target. iperf3
+        # is single-threaded, so one core of the node is enough.
+        nic_cpus = self._nic_numa_cpus()
+        if nic_cpus:
+            cmd.extend(["-A", str(nic_cpus[0])])
+
         if protocol == "udp":
-            cmd.append("-u")
+            cmd.extend(["-u", "-l", "1400"])  # payload sized to fit the MTU
+        else:
+            # 256K buffers cut syscalls per GB; -Z avoids copying each
+            # buffer through the kernel, which caps single-thread TCP
+            # throughput well below the 20 Gbps target.
+            cmd.extend(["-l", "256K"])
+            if _kernel_supports_zerocopy():
+                cmd.append("-Z")
         if reverse:
             cmd.append("-R")
-            
+
+        # Write the JSON report to tmpfs instead of piping hundreds of KB of
+        # per-interval stats through Python's stdout buffer. A uuid keeps
+        # concurrent tests on the same port from colliding.
+        log_path = os.path.join(
+            _SHM_DIR, f"iperf3_{os.getpid()}_{uuid.uuid4().hex}.json")
+        cmd.extend(["--logfile", log_path])
+
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=self.duration + 10)
+            result = subprocess.run(cmd, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE, text=True,
+                                    timeout=self.duration + 10,
+                                    close_fds=False)
             if result.returncode == 0:
-                return json.loads(result.stdout)
+                return _load_json_file(log_path)
             else:
                 print(f"iperf3 failed: {result.stderr}")
                 return {}
         except subprocess.TimeoutExpired:
             print("iperf3 test timed out")
             return {}
-        except json.JSONDecodeError:
+        except ValueError:
             print("Failed to parse iperf3 JSON output")
             return {}
+        finally:
+            try:
+                os.unlink(log_path)
+            except OSError:
+                pass
     
     def measure_latency(self) -> Dict:
-        """Measure latency using ping and custom tools."""
+        """Measure latency using ping and custom tools.
+
+        The 100-packet ping takes ~10 s, so results are cached for
+        PROBE_CACHE_TTL_S and shared across tests run back-to-back.
+        """
+        if (self._latency_cache is not None and
+                time.time() - self._latency_cache_time < PROBE_CACHE_TTL_S):
+            return self._latency_cache
+
         latency_results = {
             "avg_latency_us": 0,
             "min_latency_us": 0,
@@ -72,26 +427,42 @@ class VirtIONicBenchmark:
         # Use ping for basic latency measurement
         try:
             cmd = ["ping", "-c", "100", "-i", "0.1", self.target_host]
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            
+            result = subprocess.run(cmd, capture_output=True, timeout=30,
+                                    close_fds=False)
+
             if result.returncode == 0:
-                # Parse ping output
-                lines = result.stdout.split('\n')
-                for line in lines:
-                    if 'rtt min/avg/max/mdev' in line:
-                        match = re.search(r'(\d+\.?\d*)/(\d+\.?\d*)/(\d+\.?\d*)/(\d+\.?\d*)', line)
-                        if match:
-                            latency_results["min_latency_us"] = float(match.group(1))
-                            latency_results["avg_latency_us"] = float(match.group(2))
-                            latency_results["max_latency_us"] = float(match.group(3))
-                            break
+                # Single regex pass over the raw bytes; no split, no
+                # per-line substring test, no decode.
+                match = _PING_SUM_RE.search(result.stdout)
+                if match:
+                    latency_results["min_latency_us"] = float(match.group(1))
+                    latency_results["avg_latency_us"] = float(match.group(2))
+                    latency_results["max_latency_us"] = float(match.group(3))
+
+                # 99th percentile from the per-packet samples, which the
+                # summary line does not provide.
+                samples = sorted(float(m.group(1))
+                                 for m in _PING_TIME_RE.finditer(result.stdout))
+                if samples:
+                    idx = min(len(samples) - 1, int(len(samples) * 0.99))
+                    latency_results["99th_percentile_us"] = samples[idx]
         except Exception as e:
             print(f"Latency measurement failed: {e}")
-        
+
+        self._latency_cache = latency_results
+        self._latency_cache_time = time.time()
         return latency_results
     
     def get_system_metrics(self) -> Dict:
-        """Get system metrics including CPU and NUMA info."""
+        """Get system metrics including CPU and NUMA info.
+
+        Cached for PROBE_CACHE_TTL_S; the /proc contents barely change
+        between tests in the same invocation.
+        """
+        if (self._metrics_cache is not None and
+                time.time() - self._metrics_cache_time < PROBE_CACHE_TTL_S):
+            return self._metrics_cache
+
         metrics = {
             "cpu_count": 0,
             "numa_nodes": 0,
@@ -100,47 +471,65 @@ class VirtIONicBenchmark:
         }
         
         try:
-            # Get CPU count
-            with open('/proc/cpuinfo', 'r') as f:
-                cpu_count = len([line for line in f if line.startswith('processor')])
-                metrics["cpu_count"] = cpu_count
-            
-            # Get NUMA nodes
-            with open('/proc/buddyinfo', 'r') as f:
-                numa_nodes = len(set(line.split()[1] for line in f))
-                metrics["numa_nodes"] = numa_nodes
-            
-            # Get CPU usage
-            with open('/proc/stat', 'r') as f:
-                cpu_line = f.readline().split()
-                total = sum(int(x) for x in cpu_line[1:])
-                idle = int(cpu_line[4])
+            metrics["cpu_count"], metrics["numa_nodes"] = _static_topology()
+
+            # CPU usage as a delta against the previous snapshot; a single
+            # /proc/stat read gives utilization since boot, which says
+            # nothing about the test window.
+            total, idle = _sample_cpu()
+            if self._cpu_sample is not None:
+                d_total = total - self._cpu_sample[0]
+                d_idle = idle - self._cpu_sample[1]
+                if d_total > 0:
+                    metrics["cpu_usage"] = (1 - d_idle / d_total) * 100
+            else:
                 metrics["cpu_usage"] = (1 - idle / total) * 100
-                
+            self._cpu_sample = (total, idle)
+
         except Exception as e:
             print(f"Failed to get system metrics: {e}")
-        
+
+        self._metrics_cache = metrics
+        self._metrics_cache_time = time.time()
         return metrics
     
     def run_throughput_test(self) -> BenchmarkResult:
         """Run throughput test and return results."""
         print("Running throughput test...")
-        
-        # Run TCP upload test
-        tcp_result = self.run_iperf3_test(reverse=False, protocol="tcp")
-        
-        # Run TCP download test
-        tcp_download = self.run_iperf3_test(reverse=True, protocol="tcp")
-        
+
+        # Anchor the CPU-usage window at the start of the test
+        self._cpu_sample = _sample_cpu()
+
+        # Overlap the ~10 s ping probe with the iperf3 window instead of
+        # running it afterwards; the thread result doubles as the cache entry.
+        probe_result: List[Dict] = []
+        probe_thread = threading.Thread(
+            target=lambda: probe_result.append(self.measure_latency()))
+        probe_thread.start()
+
+        # Run TCP upload and download tests concurrently; both are I/O-bound
+        # waiting on iperf3, so two threads halve the throughput phase.
+        # Separate ports because an iperf3 server serves one client at a time.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            upload_future = executor.submit(
+                self.run_iperf3_test, reverse=False, protocol="tcp",
+                port=IPERF3_BASE_PORT)
+            download_future = executor.submit(
+                self.run_iperf3_test, reverse=True, protocol="tcp",
+                port=IPERF3_BASE_PORT + 1)
+            tcp_result = upload_future.result()
+            tcp_download = download_future.result()
+
         # Calculate throughput in Gbps
-        upload_bps = tcp_result.get('end', {}).get('streams', [{}])[0].get('sender', {}).get('bits_per_second', 0)
-        download_bps = tcp_download.get('end', {}).get('streams', [{}])[0].get('sender', {}).get('bits_per_second', 0)
+        upload_bps = _sum_bps(tcp_result)
+        download_bps = _sum_bps(tcp_download)
         
         total_throughput_gbps = (upload_bps + download_bps) / 1e9
-        
-        # Measure latency
-        latency_data = self.measure_latency()
-        
+
+        # Collect the latency probe started before the iperf3 phase
+        probe_thread.join()
+        latency_data = probe_result[0] if probe_result else self.measure_latency()
+
         # Get system metrics
         system_metrics = self.get_system_metrics()
         
@@ -155,13 +544,15 @@ class VirtIONicBenchmark:
             timestamp=time.time()
         )
         
-        self.results.append(result)
+        self._record(result)
         return result
     
     def run_latency_test(self) -> BenchmarkResult:
         """Run dedicated latency test."""
         print("Running latency test...")
-        
+
+        self._cpu_sample = _sample_cpu()
+
         # Run UDP test for latency measurement
         udp_result = self.run_iperf3_test(reverse=False, protocol="udp")
         
@@ -186,86 +577,91 @@ class VirtIONicBenchmark:
             timestamp=time.time()
         )
         
-        self.results.append(result)
+        self._record(result)
         return result
     
+    def _test_az(self, index: int, endpoint: str, port: int,
+                 latency_data: Dict, system_metrics: Dict) -> Optional[BenchmarkResult]:
+        """Run one AZ's throughput test; returns None on failure."""
+        try:
+            test_result = self.run_iperf3_test(reverse=False, protocol="tcp",
+                                               port=port)
+
+            return BenchmarkResult(
+                test_name=f"az_resilience_test_{index+1}",
+                throughput_gbps=_sum_bps(test_result) / 1e9,
+                latency_us=latency_data["avg_latency_us"],
+                latency_99th_percentile=0,  # Will be calculated separately
+                cpu_usage=system_metrics["cpu_usage"],
+                numa_node=index,
+                queue_count=32,
+                timestamp=time.time()
+            )
+        except Exception as e:
+            print(f"AZ {index+1} test failed: {e}")
+            return None
+
     def run_multi_az_test(self) -> List[BenchmarkResult]:
         """Run multi-AZ resilience test."""
         print("Running multi-AZ resilience test...")
-        
-        az_results = []
-        
+
+        self._cpu_sample = _sample_cpu()
+
         # Simulate AZ failures by testing different endpoints
         az_endpoints = [
             f"{self.target_host}-az1",
-            f"{self.target_host}-az2", 
+            f"{self.target_host}-az2",
             f"{self.target_host}-az3"
         ]
-        
-        for i, endpoint in enumerate(az_endpoints):
-            try:
-                # Test each AZ
-                test_result = self.run_iperf3_test(reverse=False, protocol="tcp")
-                
-                throughput_gbps = 0
-                if test_result:
-                    bps = test_result.get('end', {}).get('streams', [{}])[0].get('sender', {}).get('bits_per_second', 0)
-                    throughput_gbps = bps / 1e9
-                
-                result = BenchmarkResult(
-                    test_name=f"az_resilience_test_{i+1}",
-                    throughput_gbps=throughput_gbps,
-                    latency_us=self.measure_latency()["avg_latency_us"],
-                    latency_99th_percentile=0,  # Will be calculated separately
-                    cpu_usage=self.get_system_metrics()["cpu_usage"],
-                    numa_node=i,
-                    queue_count=32,
-                    timestamp=time.time()
-                )
-                
-                az_results.append(result)
-                self.results.append(result)
-                
-            except Exception as e:
-                print(f"AZ {i+1} test failed: {e}")
-        
+
+        # One probe for the whole sweep; per-AZ ping/metric re-measurement
+        # added tens of seconds without changing the reported numbers.
+        latency_data = self.measure_latency()
+        system_metrics = self.get_system_metrics()
+
+        # The AZ paths are independent, so run them in parallel: 3xT
+        # becomes T. Each AZ gets its own port (single-client servers) and
+        # results are collected on the main thread, so no lock is needed.
+        with ThreadPoolExecutor(max_workers=len(az_endpoints)) as executor:
+            futures = [
+                executor.submit(self._test_az, i, endpoint,
+                                IPERF3_BASE_PORT + i, latency_data,
+                                system_metrics)
+                for i, endpoint in enumerate(az_endpoints)
+            ]
+            az_results = [f.result() for f in futures]
+
+        az_results = [r for r in az_results if r is not None]
+        for result in az_results:
+            self._record(result)
         return az_results
     
     def run_concurrent_test(self, num_threads: int = 32) -> BenchmarkResult:
-        """Run concurrent load test across multiple threads."""
-        print(f"Running concurrent test with {num_threads} threads...")
-        
-        results = []
-        threads = []
-        
-        def worker_thread(thread_id: int):
-            try:
-                # Each thread runs its own iperf3 test
-                cmd = [
-                    "iperf3", "-c", self.target_host,
-                    "-t", str(self.duration // 4),  # Shorter duration for concurrent test
-                    "-J", "-P", "1"
-                ]
-                
-                result = subprocess.run(cmd, capture_output=True, text=True, timeout=self.duration + 5)
-                if result.returncode == 0:
-                    data = json.loads(result.stdout)
-                    bps = data.get('end', {}).get('streams', [{}])[0].get('sender', {}).get('bits_per_second', 0)
-                    results.append(bps)
-                    
-            except Exception as e:
-                print(f"Thread {thread_id} failed: {e}")
-        
-        # Start threads
-        for i in range(num_threads):
-            thread = threading.Thread(target=worker_thread, args=(i,))
-            threads.append(thread)
-            thread.start()
-        
-        # Wait for all threads to complete
-        for thread in threads:
-            thread.join()
-        
+        """Run concurrent load test across multiple pinned worker processes."""
+        print(f"Running concurrent test with {num_threads} streams...")
+
+        self._cpu_sample = _sample_cpu()
+
+        # iperf3 is single-threaded per client, so more workers than cores
+        # just thrashes; bound the pool by CPU count and pin each stream to
+        # a distinct core, round-robined across NUMA nodes.
+        max_workers = min(num_threads, os.cpu_count() or 1)
+        # Prefer cores on the NIC's own NUMA node; fall back to spreading
+        # streams across all nodes when the node cannot be resolved.
+        cpus = self._nic_numa_cpus() or _numa_interleaved_cpus()
+        stream_duration = self.duration // 4  # Shorter duration for concurrent test
+
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(
+                    _run_stream,
+                    [self.target_host] * num_threads,
+                    [stream_duration] * num_threads,
+                    [cpus[i % len(cpus)] for i in range(num_threads)]))
+        except Exception as e:
+            print(f"Concurrent test failed: {e}")
+            results = []
+
         # Calculate aggregate results
         total_throughput_gbps = sum(results) / 1e9 if results else 0
         
@@ -280,7 +676,7 @@ class VirtIONicBenchmark:
             timestamp=time.time()
         )
         
-        self.results.append(result)
+        self._record(result)
         return result
     
     def validate_performance_targets(self) -> Dict:
@@ -300,15 +696,17 @@ class VirtIONicBenchmark:
             "overall_score": 0.0
         }
         
-        # Find best throughput result
-        best_throughput = max((r.throughput_gbps for r in self.results), default=0)
-        best_latency = min((r.latency_us for r in self.results if r.latency_us > 0), default=float('inf'))
-        avg_cpu = statistics.mean((r.cpu_usage for r in self.results), default=0)
-        
+        # O(1) reads from the running aggregates instead of rescanning
+        # the full results list per query
+        agg = self._agg
+        best_throughput = agg["tp_max"]
+        best_latency = agg["lat_min"]
+        avg_cpu = agg["cpu_sum"] / agg["n"] if agg["n"] else 0.0
+
         validation_results["throughput_achieved"] = best_throughput >= targets["throughput_gbps"]
         validation_results["latency_achieved"] = best_latency <= targets["latency_us"]
         validation_results["cpu_efficient"] = avg_cpu <= targets["cpu_usage_percent"]
-        validation_results["queue_scaling"] = any(r.queue_count >= targets["queue_count"] for r in self.results)
+        validation_results["queue_scaling"] = agg["queue_max"] >= targets["queue_count"]
         
         # Calculate overall score
         score = 0.0
@@ -321,8 +719,13 @@ class VirtIONicBenchmark:
         
         return validation_results
     
-    def generate_report(self, output_file: str = None):
-        """Generate comprehensive benchmark report."""
+    def generate_report(self, output_file: str = None, compact: bool = False):
+        """Generate comprehensive benchmark report.
+
+        A .csv output path gets a flat per-result table; anything else gets
+        the JSON report, indented unless compact is set (indent=2 roughly
+        triples the output size, which only matters for machine consumers).
+        """
         report = {
             "benchmark_info": {
                 "target_host": self.target_host,
@@ -345,24 +748,50 @@ class VirtIONicBenchmark:
             ],
             "validation": self.validate_performance_targets(),
             "summary": {
-                "max_throughput_gbps": max((r.throughput_gbps for r in self.results), default=0),
-                "min_latency_us": min((r.latency_us for r in self.results if r.latency_us > 0), default=0),
-                "avg_cpu_usage": statistics.mean((r.cpu_usage for r in self.results), default=0),
-                "total_tests_passed": len([r for r in self.results if r.throughput_gbps > 0])
+                "max_throughput_gbps": self._agg["tp_max"],
+                "min_latency_us": (self._agg["lat_min"]
+                                   if self._agg["lat_min"] != float('inf') else 0),
+                "avg_cpu_usage": _mean(r.cpu_usage for r in self.results),
+                "total_tests_passed": self._agg["passed"]
             }
         }
         
         if output_file:
-            with open(output_file, 'w') as f:
-                json.dump(report, f, indent=2)
-        
+            if output_file.endswith('.csv'):
+                # One writerows call on a single buffered handle; per-row
+                # writerow calls flush line-buffered output every time.
+                header = ["test_name", "throughput_gbps", "latency_us",
+                          "latency_99th_percentile", "cpu_usage",
+                          "numa_node", "queue_count", "timestamp"]
+                with open(output_file, 'w', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerows([header] + [
+                        [r.test_name, r.throughput_gbps, r.latency_us,
+                         r.latency_99th_percentile, r.cpu_usage,
+                         r.numa_node, r.queue_count, r.timestamp]
+                        for r in self.results
+                    ])
+            elif orjson is not None:
+                with open(output_file, 'wb') as f:
+                    f.write(orjson.dumps(
+                        report,
+                        option=0 if compact else orjson.OPT_INDENT_2))
+            else:
+                with open(output_file, 'w') as f:
+                    if compact:
+                        json.dump(report, f, separators=(',', ':'))
+                    else:
+                        json.dump(report, f, indent=2)
+
         return report
 
 def main():
     parser = argparse.ArgumentParser(description="Comprehensive VirtIO NIC benchmark")
     parser.add_argument("--target", required=True, help="Target host for testing")
     parser.add_argument("--duration", type=int, default=30, help="Test duration in seconds")
-    parser.add_argument("--output", help="Output file for results")
+    parser.add_argument("--output", help="Output file for results (.csv for a flat table)")
+    parser.add_argument("--compact-json", action="store_true",
+                       help="Write JSON output without indentation (for pipelines)")
     parser.add_argument("--tests", nargs="+", 
                        choices=["throughput", "latency", "multi_az", "concurrent", "all"],
                        default=["all"], help="Tests to run")
@@ -389,7 +818,7 @@ def main():
             benchmark.run_concurrent_test()
         
         # Generate report
-        report = benchmark.generate_report(args.output)
+        report = benchmark.generate_report(args.output, compact=args.compact_json)
         
         # Print summary
         print("\n" + "="*50)
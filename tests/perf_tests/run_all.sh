@@ -15,10 +15,17 @@ fi
 mkdir -p "$RESULT_DIR"
 TS=$(date +%Y%m%d%H%M%S)
 
-ssh "$SERVER" "nohup iperf3 -s > /tmp/iperf_server.log 2>&1 &"
+# One server per direction: an iperf3 server only accepts a single client,
+# so uplink and downlink need their own ports to run concurrently.
+ssh "$SERVER" "nohup iperf3 -s -p 5201 > /tmp/iperf_server_5201.log 2>&1 &"
+ssh "$SERVER" "nohup iperf3 -s -p 5202 > /tmp/iperf_server_5202.log 2>&1 &"
 
-iperf3 -c "$SERVER" -t "$DURATION" > "$RESULT_DIR/uplink_$TS.txt"
-iperf3 -c "$SERVER" -R -t "$DURATION" > "$RESULT_DIR/downlink_$TS.txt"
+# -i 0: only the final sum is kept; -O 2: omit the TCP slow-start window
+iperf3 -c "$SERVER" -p 5201 -i 0 -O 2 -t "$DURATION" > "$RESULT_DIR/uplink_$TS.txt" &
+UPLINK_PID=$!
+iperf3 -c "$SERVER" -p 5202 -i 0 -O 2 -R -t "$DURATION" > "$RESULT_DIR/downlink_$TS.txt" &
+DOWNLINK_PID=$!
+wait "$UPLINK_PID" "$DOWNLINK_PID"
 
 ssh "$SERVER" "pkill iperf3"
 